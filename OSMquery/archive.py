@@ -0,0 +1,114 @@
+"""
+Osmosint archive module
+
+This module deals with the archive of the raw responses of the Overpass API.
+Each response is compressed (zstd, or gzip when the zstandard package is not installed) and saved under a key made from the query,
+so that the results of a query can be processed again later, with other output options, without sending it again.
+"""
+import os
+import gzip
+import hashlib
+import datetime
+
+try:
+    import zstandard
+except ImportError: # Optional, the archive falls back to gzip
+    zstandard = None
+
+CONTENT_TYPES = { # {content type of the response: extension of the archived file}
+    "application/osm3s+xml": "xml",
+    "application/json": "json",
+}
+
+
+def archive_key(query):
+    """
+    Returns the key under which the response of a query is archived (sha256 of the query)
+    """
+    return hashlib.sha256(query.strip().encode("utf-8")).hexdigest()
+
+
+def compress(data):
+    """
+    Compresses the data with zstd if available, gzip if not
+
+    Returns:
+        The compressed data and the extension of the compression (".zst" or ".gz")
+    """
+    if zstandard:
+        return zstandard.ZstdCompressor(level=10).compress(data), ".zst"
+    return gzip.compress(data), ".gz"
+
+
+def decompress(data, extension):
+    """
+    Decompresses data compressed by compress()
+    """
+    if extension == ".zst":
+        if not zstandard:
+            raise ValueError("The zstandard package is needed to read .zst archives (pip install zstandard).")
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return gzip.decompress(data)
+
+
+def archive_raw_response(query, content_type, raw_response, archive_dir):
+    """
+    Saves the raw response of the API in the archive directory.
+    The query is saved next to it, in a .ql file, to know what the archived response is about.
+
+    args:
+        query (str): the query sent to the API
+        content_type (str): content type of the response ("application/osm3s+xml" or "application/json")
+        raw_response (bytes): the uncompressed response of the API
+        archive_dir (str): directory of the archive
+
+    Returns:
+        file_name (str) of the archived response
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    key = archive_key(query)
+    compressed_response, compression = compress(raw_response)
+
+    file_name = os.path.join(archive_dir, f"{key}.{CONTENT_TYPES[content_type]}{compression}")
+    with open(file_name, "wb") as file:
+        file.write(compressed_response)
+    with open(os.path.join(archive_dir, f"{key}.ql"), "w", encoding="utf-8") as file:
+        file.write(f"// Archived on {datetime.datetime.now().strftime('%d/%m/%Y at %H:%M')}\n{query.strip()}\n")
+    return file_name
+
+
+def find_archived_response(query, archive_dir):
+    """
+    Looks for the archived response of a query
+
+    Returns:
+        file_name (str) of the archived response, None if the query was never archived
+    """
+    key = archive_key(query)
+    for extension in CONTENT_TYPES.values():
+        for compression in (".zst", ".gz"):
+            file_name = os.path.join(archive_dir, f"{key}.{extension}{compression}")
+            if os.path.exists(file_name):
+                return file_name
+    return None
+
+
+def load_archived_response(file_name):
+    """
+    Reads an archived response
+
+    args:
+        file_name (str): path of the archived response (e.g. from find_archived_response())
+
+    Returns:
+        content_type (str) and raw_response (bytes), to give to parse_raw_response()
+        Raises a ValueError if the file is not an archived response.
+    """
+    base_name, compression = os.path.splitext(file_name)
+    extension = os.path.splitext(base_name)[1].lstrip(".")
+    content_types = {extension: content_type for content_type, extension in CONTENT_TYPES.items()}
+    if compression not in (".zst", ".gz") or extension not in content_types:
+        raise ValueError(f"{file_name} is not an archived response of Osmosint.")
+
+    with open(file_name, "rb") as file:
+        return content_types[extension], decompress(file.read(), compression)
@@ -0,0 +1,222 @@
+"""
+Osmosint geometry module
+
+This module deals with the regions of the queries that are not a simple area name or bbox (polygons),
+and with the geometric computations done locally on the results.
+"""
+import json
+import math
+import itertools
+
+EARTH_RADIUS = 6371008.8 # Mean radius of the earth, in meters
+
+
+def polygon_from_geojson(geojson):
+    """
+    Extracts the rings of a polygon from GeoJSON data
+
+    args:
+        geojson (dict): GeoJSON Polygon, MultiPolygon, Feature or FeatureCollection
+
+    Returns:
+        polygon (list): list of rings, each ring being a list of (latitude, longitude) tuples.
+        Raises a ValueError if the GeoJSON does not contain any polygon.
+    """
+    def check_list(value, description):
+        if not isinstance(value, list):
+            raise ValueError(f"Invalid GeoJSON data: {description} must be a list.")
+        return value
+
+    def position(point):
+        # GeoJSON coordinates are written longitude first
+        if (not isinstance(point, list) or len(point) < 2
+                or not all(isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value) for value in point[:2])):
+            raise ValueError(f"Invalid GeoJSON position: {point!r}. A position is a list of numbers: [longitude, latitude].")
+        return float(point[1]), float(point[0])
+
+    if not isinstance(geojson, dict):
+        raise ValueError("The GeoJSON data must be an object.")
+
+    rings = []
+    match geojson.get("type"):
+        case "FeatureCollection":
+            for feature in check_list(geojson.get("features", []), "the features of a FeatureCollection"):
+                rings.extend(polygon_from_geojson(feature))
+        case "Feature":
+            rings.extend(polygon_from_geojson(geojson.get("geometry") or {}))
+        case "Polygon":
+            rings.extend(check_list(geojson.get("coordinates", []), "the coordinates of a Polygon"))
+        case "MultiPolygon":
+            for polygon in check_list(geojson.get("coordinates", []), "the coordinates of a MultiPolygon"):
+                rings.extend(check_list(polygon, "each polygon of a MultiPolygon"))
+        case _:
+            raise ValueError(f"Unsupported GeoJSON type: {geojson.get('type')}. Use a Polygon or a MultiPolygon.")
+
+    if geojson.get("type") in ("Polygon", "MultiPolygon"):
+        rings = [[position(point) for point in check_list(ring, "each ring of a polygon")] for ring in rings]
+    rings = [ring for ring in rings if len(ring) >= 3]
+    if not rings:
+        raise ValueError("The GeoJSON data does not contain any polygon.")
+    return rings
+
+
+def load_geojson_polygon(file_name):
+    """
+    Reads a GeoJSON file and extracts its polygon
+
+    args:
+        file_name (str): path of the GeoJSON file
+
+    Returns:
+        polygon (list): list of rings, each ring being a list of (latitude, longitude) tuples.
+        Raises a ValueError if the file cannot be read or does not contain any polygon.
+    """
+    try:
+        with open(file_name, encoding="utf-8") as file:
+            geojson = json.load(file)
+    except OSError as error:
+        raise ValueError(f"The file {file_name} could not be opened: {error.strerror}")
+    except json.JSONDecodeError:
+        raise ValueError(f"The file {file_name} is not a valid GeoJSON file.")
+    return polygon_from_geojson(geojson)
+
+
+def polygon_bbox(polygon):
+    """
+    Computes the bbox that contains the whole polygon
+
+    args:
+        polygon (list): list of rings of (latitude, longitude) tuples
+
+    Returns:
+        bbox (list): [latitude_SW, longitude_SW, latitude_NE, longitude_NE]
+    """
+    latitudes = [lat for ring in polygon for lat, lon in ring]
+    longitudes = [lon for ring in polygon for lat, lon in ring]
+    return [min(latitudes), min(longitudes), max(latitudes), max(longitudes)]
+
+
+def outer_rings(polygon):
+    """
+    Returns the rings of the polygon that are not inside another ring: the holes (and the islands in the holes) are left out
+
+    The rings of a polygon do not cross each other, so a ring is inside another one when its first vertex is.
+
+    args:
+        polygon (list): list of rings of (latitude, longitude) tuples
+
+    Returns:
+        list of the outer rings
+    """
+    bboxes = [polygon_bbox([ring]) for ring in polygon]
+    rings = []
+    for index, ring in enumerate(polygon):
+        lat, lon = ring[0]
+        if not any(other_index != index and south <= lat <= north and west <= lon <= east
+                   and points_in_polygon([ring[0]], [polygon[other_index]])[0]
+                   for other_index, (south, west, north, east) in enumerate(bboxes)):
+            rings.append(ring)
+    return rings
+
+
+def points_in_polygon(points, polygon):
+    """
+    Checks which points are inside the polygon (even-odd rule, so holes and multipolygons are handled)
+
+    The edges of the polygon are first sorted into horizontal bands of latitude,
+    so that each point is only tested against the few edges of its own band instead of every edge.
+
+    args:
+        points (list): list of tuples starting with (latitude, longitude)
+        polygon (list): list of rings of (latitude, longitude) tuples
+
+    Returns:
+        list of booleans, True for each point inside the polygon
+    """
+    edges = []
+    for ring in polygon:
+        for index in range(len(ring)):
+            lat_1, lon_1 = ring[index - 1]
+            lat_2, lon_2 = ring[index]
+            if lat_1 != lat_2: # Horizontal edges are never crossed
+                edges.append((lat_1, lon_1, lat_2, lon_2))
+
+    south, west, north, east = polygon_bbox(polygon)
+    band_count = max(1, int(math.sqrt(len(edges))))
+    band_height = (north - south) / band_count or 1
+
+    def band_of(lat):
+        return min(band_count - 1, max(0, int((lat - south) / band_height)))
+
+    bands = [[] for _ in range(band_count)]
+    for edge in edges:
+        for band in range(band_of(min(edge[0], edge[2])), band_of(max(edge[0], edge[2])) + 1):
+            bands[band].append(edge)
+
+    inside_points = []
+    for point in points:
+        lat, lon = point[0], point[1]
+        inside = False
+        if south <= lat <= north and west <= lon <= east:
+            for lat_1, lon_1, lat_2, lon_2 in bands[band_of(lat)]:
+                # Ray casting towards the east: count the edges crossed by the ray
+                if (lat_1 > lat) != (lat_2 > lat) and lon < lon_1 + (lat - lat_1) * (lon_2 - lon_1) / (lat_2 - lat_1):
+                    inside = not inside
+        inside_points.append(inside)
+    return inside_points
+
+
+def haversine_distance(lat_1, lon_1, lat_2, lon_2):
+    """
+    Computes the distance between two coordinates on earth, in meters (haversine formula)
+    """
+    lat_1, lon_1, lat_2, lon_2 = map(math.radians, (lat_1, lon_1, lat_2, lon_2))
+    a = math.sin((lat_2 - lat_1) / 2) ** 2 + math.cos(lat_1) * math.cos(lat_2) * math.sin((lon_2 - lon_1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+def nearest_nodes(points, nodes, max_distance=None):
+    """
+    Finds, for each point, the nearest node and the distance to it
+
+    When max_distance is given, the nodes are first sorted into a grid of cells of max_distance,
+    so that each point is only compared to the nodes of its cell and of the 8 cells around it.
+    Points without any node within max_distance are compared to every node.
+
+    args:
+        points (list): list of tuples starting with (latitude, longitude)
+        nodes (list): list of (latitude, longitude, id) tuples
+        max_distance (float): distance in meters under which the nearest node is expected to be
+
+    Returns:
+        list of (id of the nearest node, distance in meters) tuples, (None, None) if there is no node
+    """
+    def search(point, candidates):
+        nearest = (None, None)
+        for lat, lon, node_id in candidates:
+            distance = haversine_distance(point[0], point[1], lat, lon)
+            if nearest[1] is None or distance < nearest[1]:
+                nearest = (node_id, distance)
+        return nearest
+
+    if not max_distance or not points or not nodes:
+        return [search(point, nodes) for point in points]
+
+    # Cells are sized for the latitude where a degree of longitude is the shortest, so no node in range is missed
+    max_lat = min(89.0, max(abs(point[0]) for point in itertools.chain(points, nodes)))
+    cell_lat = max_distance / (math.pi * EARTH_RADIUS / 180)
+    cell_lon = cell_lat / math.cos(math.radians(max_lat))
+
+    grid = {}
+    for node in nodes:
+        grid.setdefault((int(node[0] // cell_lat), int(node[1] // cell_lon)), []).append(node)
+
+    nearest = []
+    for point in points:
+        row, column = int(point[0] // cell_lat), int(point[1] // cell_lon)
+        candidates = [node for d_row in (-1, 0, 1) for d_column in (-1, 0, 1) for node in grid.get((row + d_row, column + d_column), [])]
+        node_id, distance = search(point, candidates)
+        if distance is None or distance > max_distance:
+            node_id, distance = search(point, nodes)
+        nearest.append((node_id, distance))
+    return nearest
@@ -7,23 +7,102 @@ import os
 import csv
 import sys
 import datetime
+import itertools
 from utils.utils import exit_prog
 
 
-def create_google_links(decimal_coordinates):
+LINK_TEMPLATES = { # {provider: (name, url template)}
+    "google": ("Google Maps", "https://www.google.com/maps?q=loc:{lat},{lon}&hl=en&z=18"),
+    "osm": ("OpenStreetMap", "https://www.openstreetmap.org/?mlat={lat}&mlon={lon}#map=18/{lat}/{lon}"),
+    "bing": ("Bing Maps", "https://www.bing.com/maps?cp={lat}~{lon}&lvl=18&sp=point.{lat}_{lon}"),
+    "geo": ("geo", "geo:{lat},{lon}"),
+}
+
+WRITE_CHUNK_SIZE = 1000 # Number of results formatted and written to the file at once
+
+
+def create_links(decimal_coordinates, provider="google"):
     """
-    Function that takes a list of coordinates and turns them into Google Maps links.
+    Function that takes coordinates and turns them into links of a map provider.
+    The links are only created when they are read (e.g. while writing them in a file), they are never all kept in memory.
 
     Args:
-        decimal_coordinates (list): List that contains tuples of the coordinates in decimal format.
+        decimal_coordinates (iterable): tuples starting with the coordinates in decimal format.
+        provider (str): map provider of the links, one of LINK_TEMPLATES ("google", "osm", "bing" or "geo")
+
+    Returns: An iterator over the links associated to the coordinates
+    """
+    template = LINK_TEMPLATES[provider][1]
+    return (template.format(lat=result[0], lon=result[1]) for result in decimal_coordinates)
+
+
+def format_results(results, format_type):
+    """
+    Turns decimal coordinates into the given output format, one result at a time
+
+    args:
+        results (iterable): tuples starting with the coordinates in decimal format
+        format_type (str): "decimal", "dms", or "<provider>_urls" (e.g. "osm_urls")
+
+    Returns:
+        An iterator over the formatted results. Each result is a tuple of the columns to output.
+    """
+    from convert.conversion import decimal_to_dms
+
+    if format_type == "decimal":
+        return ((result[0], result[1]) for result in results)
+    elif format_type == "dms":
+        return (decimal_to_dms(result[0], result[1]) for result in results)
+    elif format_type.endswith("_urls"):
+        return ((url,) for url in create_links(results, format_type.removesuffix("_urls")))
+
+
+def format_title(format_type):
+    """
+    Returns the title of the output format, written before the results in files
+    """
+    if format_type == "decimal":
+        return "Coordinates in Decimal Format"
+    elif format_type == "dms":
+        return "Coordinates in DMS Format"
+    return f"{LINK_TEMPLATES[format_type.removesuffix('_urls')][0]} URLs"
+
+
+def annotation_title(parameters):
+    """
+    Describes the columns written after the coordinates of radius results (see extract_data_from_result())
+    """
+    if parameters["type_query"] == "radius":
+        return f" (followed by the id of the nearest {parameters['tag_2']} node and the distance to it in meters)"
+    return ""
+
+
+def iter_chunks(results, chunk_size):
+    """
+    Splits results into lists of chunk_size results, without reading more than one chunk at a time
+    """
+    results = iter(results)
+    while chunk := list(itertools.islice(results, chunk_size)):
+        yield chunk
+
+
+def describe_location(parameters):
+    """
+    Describes the location of the query, to write it in messages and file headers
+
+    args:
+        parameters (dict): dictionnary of all the query parameters
 
-    Returns: A list that contains all the google maps links associated to the coordinates
+    Returns:
+        location (str), e.g. "Paris" or "the following bbox [...]"
     """
-    urls = []
-    for lat, lon in decimal_coordinates:
-        url = f"https://www.google.com/maps?q=loc:{lat},{lon}&hl=en&z=18"
-        urls.append(url)
-    return urls
+    if parameters["location"]:
+        return parameters["location"][0]
+    if parameters.get("polygon"):
+        return f"the given polygon ({sum(len(ring) for ring in parameters['polygon'])} vertices)"
+    if parameters.get("bboxes"):
+        return f"the following bboxes {parameters['bboxes']}"
+    return f"the following bbox {parameters['bbox']}"
 
 
 def establish_file_header(parameters):
@@ -36,11 +115,7 @@ def establish_file_header(parameters):
     Returns:
         header (str): description of what the file will include
     """
-    if parameters["location"]:
-        location = parameters["location"][0]
-
-    if parameters["bbox"]:
-        location = parameters["location"]
+    location = describe_location(parameters)
 
     match parameters["type_query"]:
         case "locate":
@@ -55,11 +130,11 @@ def write_results_file(data, parameters, file_name, format='txt', data_types=[])
     """
     Function that writes data in a specific file
     First goes through the format to chose for the file.
-    Then goes through the data_types list (either "decimal", "dms" or "urls")
-    For each data_type, goes through the dictionary's associated list and write every element in the file
+    Then goes through the data_types list (either "decimal", "dms" or "<provider>_urls")
+    For each data_type, goes through the dictionary's associated results chunk by chunk and write every element in the file
 
     args:
-        data (dict): dict of the data to write. Format is {output_format:[list of coordinates/url]}
+        data (dict): dict of the data to write. Format is {output_format: iterable of results}, each result being a tuple of columns
         parameters (dict): dictionnary of all the query parameters, to write the header about the query
         file_name (str) : name of the file
         format='text' (callable) : by default it writes a txt file, unless csv specifically mentioned
@@ -86,24 +161,12 @@ def write_results_file(data, parameters, file_name, format='txt', data_types=[])
                 writer.writerow([header])
                         
                 for data_type in data_types:
-                    
-                    if data_type == 'decimal':
-                        writer.writerow(['Coordinates in Decimal Format:'])
-                        for lat, lon in data.get(data_type, []):
-                            writer.writerow([lat, lon])
-                            
-                    elif data_type == 'dms':
-                        writer.writerow(['Coordinates in DMS Format:'])
-                        for lat, lon in data.get(data_type, []):
-                            writer.writerow([lat, lon])
-                            
-                    elif data_type == 'urls':
-                        writer.writerow(['Google Maps URLs'])
-                        for url in data.get('urls', []):
-                            writer.writerow([url])
+                    writer.writerow([f"{format_title(data_type)}{annotation_title(parameters)}:"])
+                    for chunk in iter_chunks(data.get(data_type, []), WRITE_CHUNK_SIZE):
+                        writer.writerows(chunk)
         except PermissionError:
             print("Permission to write in the Result.csv file was denied. Close the file and try again.")
-            exit_prog()
+            exit_prog(1)
     
     else:  # By default --> text format
         with open(file_name, mode, encoding='utf-8') as file:
@@ -111,21 +174,9 @@ def write_results_file(data, parameters, file_name, format='txt', data_types=[])
             file.write(header)
 
             for data_type in data_types:
-                
-                if data_type == 'decimal':
-                    file.write("Coordinates in Decimal Format:\n")
-                    for lat, lon in data.get(data_type, []):
-                        file.write(f"{lat}, {lon}\n")
-                        
-                elif data_type == 'dms':
-                    file.write("Coordinates in DMS Format:\n")
-                    for lat, lon in data.get(data_type, []):
-                        file.write(f"{lat}, {lon}\n")
-                        
-                elif data_type == 'urls':
-                    file.write("Google Maps URLs:\n")
-                    for url in data.get('urls', []):
-                        file.write(f"{url}\n")
+                file.write(f"{format_title(data_type)}{annotation_title(parameters)}:\n")
+                for chunk in iter_chunks(data.get(data_type, []), WRITE_CHUNK_SIZE):
+                    file.writelines(", ".join(str(value) for value in result) + "\n" for result in chunk)
                 file.write("\n\n")
 
     print("\nFile writing completed!")
@@ -145,52 +196,51 @@ def check_if_results(query_result, parameters):
         True if result, False if not
     """
     if len(query_result) == 0:
+        location = describe_location(parameters)
         match parameters["type_query"]:
             case 'locate':
-                if parameters["location"]:
-                    print(f"\nThe query found 0 {parameters['tag_1']} in {parameters['location'][0]}.")
-                elif parameters["bbox"]:
-                    print(f"\nThe query found 0 {parameters['tag_1']} in the following bbox {parameters['bbox']}.")
+                print(f"\nThe query found 0 {parameters['tag_1']} in {location}.")
             case 'radius':
-                if parameters["location"]:
-                    print(f"\nThe query found 0 {parameters['tag_1']} within a {parameters['radius']}m radius of a "
-                            f"{parameters['tag_2']} in {parameters['location'][0]}.")
-                elif parameters["bbox"]:
-                    print(f"\nThe query found 0 {parameters['tag_1']} within a {parameters['radius']}m radius of a "
-                            f"{parameters['tag_2']} in this bbox : {parameters['bbox']}.")
+                print(f"\nThe query found 0 {parameters['tag_1']} within a {parameters['radius']}m radius of a "
+                        f"{parameters['tag_2']} in {location}.")
         print("\nMake sure that the parameters you entered are correct: ")
         for key, value in parameters.items():
-            if value != None and value != False:
+            if value != None and value != False and key != "polygon": # The polygon is already described above
                 print(f"    {key} : {value}")
         print("If you are certain that the query should yield result and the parameters are correct, visit the documentation to troubleshoot what could be wrong.")
-        sys.exit()
+        sys.exit(1 if parameters.get("stream") else 0) # A pipe can tell that nothing was found
         return False
             
     else:
         return True
 
 
-def check_len_results(results, threshold):
+def check_len_results(len_results, threshold):
     """
     Function that checks whether the query returned more results than the limit allowed
 
     args:
-        results (list): result from the api in decimal format
-        threshold (int): maximal number of result
+        len_results (int): number of results to output
+        threshold (int): maximal number of result. 0 or None to disable the check.
 
     Returns:
-        False if the query did not return more than the limit
+        False if the query did not return more than the limit, or if there is no user to ask (input or output not in a terminal)
         True if the query returned more than the limit and the user decided to get the results in a file.
         Exits the program if the query returned more than then limit and the user decided to leave.
     """
     from input.input import get_input
-    len_results = len(results)
 
-    if len_results <= threshold:
+    if not threshold or len_results <= threshold:
+        return False
+    elif not sys.stdin.isatty() or not sys.stdout.isatty():
+        # Nobody can see or answer the prompt (e.g. piped input or output), so the results are printed anyway
+        print(f"\nThe query returned {len_results} results, over the threshold for printing ({threshold}). "
+              "Printing them anyway, since the input or the output is not a terminal.", file=sys.stderr)
         return False
     elif len_results > threshold:
         while True:
             print(f"\nThe query returned {len_results} results. This is over the maximum threshold for printing ({threshold}).")
+            print("You can change the threshold with --threshold, or print the results page by page with --page_size.")
             print("\nOptions:")
             print("1. Print all results in a file")
             print("2. Cancel (all unsaved data will be lost)")
@@ -200,61 +250,96 @@ def check_len_results(results, threshold):
                     return True
                 case 2:
                     exit_prog()
-            
+
+
+def select_results(raw_results, parameters):
+    """
+    Selects the part of the results to output, based on --offset and --limit.
+    The results are not copied: the selection is read lazily.
+
+    args:
+        raw_results (list): list of tuples [(latitude1, longitude1), (latitude2, longitude2)]
+        parameters (dict): dictionary with all the parameters.
+
+    Returns:
+        A function returning a new iterator over the selected results every time it is called,
+        and the number of selected results.
+    """
+    offset = parameters.get("offset") or 0
+    limit = parameters.get("limit")
+    stop = len(raw_results) if limit is None else min(len(raw_results), offset + limit)
+
+    def selected_results():
+        return itertools.islice(raw_results, offset, stop)
+
+    return selected_results, max(0, stop - offset)
+
 
 def output_results(raw_results, parameters):
     """
     Output the result based on user's decisions
-    Can print and file_write, and can display either decimal coordinates, dms coordinates or google maps urls
+    Can print and file_write, and can display either decimal coordinates, dms coordinates or map urls (Google Maps, OSM, Bing, geo:)
+    Results are formatted one at a time while they are printed or written, so they are never all copied in memory.
     args:
         raw_results (list): list of tuples [(latitude1, longitude1), (latitude2, longitude2)]
+            For radius queries, each tuple also contains the id of the nearest node of the second tag and the distance to it.
         parameters (dict): dictionary with all the parameters.
     
     """
-    from convert.conversion import decimal_to_dms
+    page_size = parameters.get("page_size")
+    selected_results, len_results = select_results(raw_results, parameters)
 
-       
-    def print_results(results): # Basic print function for printing and prevent redundancy
-        try: # If decimal format
-            for lat, lon in results:
-                print(f"{lat}, {lon}")
-        except: # If url format
-            for result in results:
-                print(result)
-            
-            print(result)
+    def format_with_annotations(format_type):
+        # The nearest node and the distance of radius results are written once, after the columns of the format
+        formatted_results = format_results(selected_results(), format_type)
+        return (formatted + tuple(result[2:]) for formatted, result in zip(formatted_results, selected_results()))
 
-    def format_results(results, format_type): 
-        if format_type == "decimal":
-            return [(lat, lon) for lat, lon in results]
-        elif format_type == "dms":
-            return [decimal_to_dms(lat, lon) for lat, lon in results]
-        elif format_type == "urls":
-            return create_google_links(results)
+    def result_to_text(result):
+        return ", ".join(str(value) for value in result)
+
+    def print_results(results): # Basic print function for printing and prevent redundancy
+        page_count = -(-len_results // page_size) if page_size else 1
+        for index, result in enumerate(results):
+            if page_size and index % page_size == 0:
+                sys.stdout.flush() # Each page is sent right away, e.g. to the next program of a pipe
+                if not parameters.get("stream"):
+                    print(f"\n-- Page {index // page_size + 1}/{page_count} --")
+            print(result_to_text(result))
+        sys.stdout.flush()
 
     # Handle the format(s) that the user decided for the output
-    output_formats = ["decimal", "dms", "urls"]
     selected_formats = []
-    for formats in output_formats:
-        if parameters.get(f"{formats}_coord") or (formats == "urls" and parameters["google_urls"]):
+    for formats in ["decimal", "dms"]:
+        if parameters.get(f"{formats}_coord"):
             selected_formats.append(formats)
-
-    if check_len_results(raw_results, 100) == True:
+    link_providers = list(parameters.get("link_providers") or [])
+    if parameters["google_urls"] and "google" not in link_providers:
+        link_providers.insert(0, "google")
+    for provider in link_providers:
+        selected_formats.append(f"{provider}_urls")
+
+    if parameters.get("stream") and not parameters["file_type"]:
+        # Only the results, one line per result with every selected format, so that they can be piped
+        rows = zip(*(format_results(selected_results(), formats) for formats in selected_formats or ["decimal"]), selected_results())
+        print_results(sum(row[:-1], ()) + tuple(row[-1][2:]) for row in rows)
+        return {}
+
+    if not parameters["file_type"] and check_len_results(len_results, parameters.get("threshold", 100)) == True:
         # Forces the file writing if the results are too big.
         parameters["file_type"] = "txt"
         
     data_to_output = {}
     for formats in selected_formats:
-        formatted_results = format_results(raw_results, formats)
+        formatted_results = format_with_annotations(formats)
         data_to_output[formats] = formatted_results
         if not parameters["file_type"]:
-            print(f"\n\nResults ({len(data_to_output[formats])}) in {formats} format:\n")
+            print(f"\n\nResults ({len_results}) in {formats} format{annotation_title(parameters)}:\n")
             print_results(formatted_results)
 
 
     if parameters["file_type"]:
         if not data_to_output: # default choice is decimal
-            data_to_output["decimal"] = format_results(raw_results, "decimal")
+            data_to_output["decimal"] = format_with_annotations("decimal")
         if not selected_formats:
             selected_formats.append("decimal")
         write_results_file(
@@ -266,8 +351,8 @@ def output_results(raw_results, parameters):
             )
 
     if not selected_formats and not parameters["file_type"]:
-        print("\nYou did not specify an output format (-dec, -dms, or -u).\nResults ({len(raw_results)}) in decimal format (default):\n")
-        print_results(format_results(raw_results, "decimal"))
+        print(f"\nYou did not specify an output format (-dec, -dms, -url or -l).\nResults ({len_results}) in decimal format (default){annotation_title(parameters)}:\n")
+        print_results(format_with_annotations("decimal"))
 
     return data_to_output
 
@@ -307,9 +392,20 @@ def welcome(args):
         print("Input format: latitude, longitude")
         print("Enter exit to leave the program.\n")
         return 'Convert'
+    elif args.command == 'serve':
+        print(osmosint_ascii)
+        print("Welcome to the Osmosint server!")
+        print("Send POST requests with a JSON body to /locate, /radius, /run or /convert. See the documentation for the details.\n")
+        return 'Serve'
  
+    if args.stream: # Nothing but the results is printed, so that they can be piped
+        return 'Stream'
+
     if args.google_urls:
         output_format.append("Google Maps URL")
+    for provider in args.links or []:
+        if provider != "google" or not args.google_urls:
+            output_format.append(f"{LINK_TEMPLATES[provider][0]} URL")
     if args.dms_coords:
         output_format.append("Coordinates in DMS format")
     if args.decimal_coords:
@@ -7,6 +7,58 @@ This module deals with the creation and sending of the OSM query to the API
 
 import overpy
 import sys
+import gzip
+import urllib.error
+import urllib.request
+from OSMquery.archive import CONTENT_TYPES, archive_raw_response, find_archived_response, load_archived_response
+from OSMquery.geometry import nearest_nodes, outer_rings, points_in_polygon, polygon_bbox
+
+MAX_POLY_VERTICES = 200 # Rings with more vertices are filtered locally instead of by the API
+
+def region_filters(parameters):
+    """
+    Builds the part of the query that restricts the nodes to the location of the query
+
+    args:
+        parameters (dict): dict of all the parameters
+
+    returns:
+        statements (str) to write before the query (e.g. to define the area)
+        filters (list) of node filters. Nodes matching any of them are in the location.
+    """
+    if parameters["location"]:
+        return f'area["name"="{parameters["location"][0]}"]->.boundaryarea;\n', ["(area.boundaryarea)"]
+
+    if parameters.get("polygon"):
+        # One filter per outer ring, so that the parts of a multipolygon far from each other do not query the area between them.
+        # Rings too long for the server are replaced by their bbox, then filtered locally (as well as the holes)
+        filters = []
+        for ring in outer_rings(parameters["polygon"]):
+            if len(ring) <= MAX_POLY_VERTICES:
+                poly = " ".join(f"{lat} {lon}" for lat, lon in ring)
+                filters.append(f'(poly:"{poly}")')
+            else:
+                bbox = polygon_bbox([ring])
+                filters.append(f"({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]})")
+        return "", filters
+
+    bboxes = parameters.get("bboxes") or [parameters["bbox"]]
+    return "", [f"({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]})" for bbox in bboxes]
+
+
+def is_polygon_sent_to_api(polygon):
+    """
+    Checks whether the polygon is entirely sent to the API as poly: filters, one per ring.
+    The API does not handle holes, and long rings make the query slow.
+
+    args:
+        polygon (list): list of rings of (latitude, longitude) tuples
+
+    returns:
+        True if the polygon is sent to the API, False if the results have to be filtered locally
+    """
+    return all(len(ring) <= MAX_POLY_VERTICES for ring in polygon) and len(outer_rings(polygon)) == len(polygon)
+
 
 def create_query(parameters):
     """
@@ -17,59 +69,144 @@ def create_query(parameters):
     returns:
         query (str) to send to API
     """
+    statements, filters = region_filters(parameters)
+
+    def node_set(tag, set_name): # Union of the nodes with the tag, in every part of the location
+        nodes = "".join(f"node{node_filter}[{tag}];" for node_filter in filters)
+        return f"({nodes})->.{set_name};\n"
+
     match parameters["type_query"]:
         case "locate":
-            if parameters["location"]:
-                query = f"""
-area["name"="{parameters["location"][0]}"]->.boundaryarea;
-(node(area.boundaryarea)[{parameters["tag_1"]}];)->.A;
-out body;
-"""
-            else: # Going for Bbox
-                query = f"""
-[bbox:{parameters["bbox"][0]},{parameters["bbox"][1]},{parameters["bbox"][2]},{parameters["bbox"][3]}];
-node[{parameters["tag_1"]}];)->.A;
-out body;
+            query = f"""
+{statements}{node_set(parameters["tag_1"], "A")}.A out body;
 """
 
         case "radius":
-            if not parameters["location"] == None:
-                query = f"""
-area["name"={parameters["location"][0]}]->.boundaryarea;
-(node(area.boundaryarea)[{parameters["tag_1"]}];)->.A;
-(node(area.boundaryarea)[{parameters["tag_2"]}];)->.B;
-nwr.A(around.B:{parameters["radius"]});
-out body;
-                """
-            else: # Going for Bbox
-                query = f"""
-[bbox:{parameters["bbox"][0]},{parameters["bbox"][1]},{parameters["bbox"][2]},{parameters["bbox"][3]}];
-(node[{parameters["tag_1"]}];)->.A;
-(node[{parameters["tag_2"]}];)->.B;
-nwr.A(around.B:{parameters["radius"]});
-out body;
-                """
+            # The matches are output with their tags, then the nodes of the second tag close to them without tags,
+            # which is how extract_data_from_result() tells them apart.
+            query = f"""
+{statements}{node_set(parameters["tag_1"], "A")}{node_set(parameters["tag_2"], "B")}nwr.A(around.B:{parameters["radius"]})->.matches;
+node.B(around.matches:{parameters["radius"]})->.near;
+.matches out body;
+.near out skel;
+"""
     return query
 
 
-def query_to_api(query):
+def filter_results_in_region(results, parameters):
+    """
+    Removes the results outside of the polygon of the query, when the polygon could not be sent to the API
+
+    args:
+        results (list): list of coordinates in tuples, from extract_data_from_result()
+        parameters (dict): dict of all the parameters
+
+    returns:
+        results (list) inside the location of the query
+    """
+    polygon = parameters.get("polygon")
+    if not polygon or is_polygon_sent_to_api(polygon):
+        return results
+    inside_points = points_in_polygon(results, polygon)
+    return [result for result, inside in zip(results, inside_points) if inside]
+
+
+def fetch_raw_response(query):
+    """
+    Sends the query to the api, accepting a gzip-compressed response to make big responses faster to download.
+    HTTP errors are raised as the same exceptions as overpy.
+
+    args:
+        query (str) : the query to send to the api, from create_query()
+
+    Returns
+        content_type (str) and raw_response (bytes), the uncompressed response of the api
+    """
+    request = urllib.request.Request(
+        overpy.Overpass.default_url,
+        data=query.encode("utf-8"),
+        headers={"Accept-Encoding": "gzip"},
+    )
+    try:
+        response = urllib.request.urlopen(request)
+    except urllib.error.HTTPError as error:
+        match error.code:
+            case 400: # Messages of the api explaining the error, extracted the same way as overpy
+                error_response = error.read()
+                if error.headers.get("Content-Encoding") == "gzip":
+                    error_response = gzip.decompress(error_response)
+                api = overpy.Overpass()
+                msgs = []
+                for msg_raw in api._regex_extract_error_msg.finditer(error_response):
+                    msg_clean_bytes = api._regex_remove_tag.sub(b"", msg_raw.group("msg"))
+                    try:
+                        msgs.append(msg_clean_bytes.decode("utf-8"))
+                    except UnicodeDecodeError:
+                        msgs.append(repr(msg_clean_bytes))
+                raise overpy.exception.OverpassBadRequest(query, msgs=msgs)
+            case 429:
+                raise overpy.exception.OverpassTooManyRequests()
+            case 504:
+                raise overpy.exception.OverpassGatewayTimeout()
+        raise overpy.exception.OverpassUnknownHTTPStatusCode(error.code)
+
+    with response:
+        raw_response = response.read()
+        if response.headers.get("Content-Encoding") == "gzip":
+            raw_response = gzip.decompress(raw_response)
+        content_type = (response.headers.get("Content-Type") or "").split(";")[0].strip()
+    return content_type, raw_response
+
+
+def parse_raw_response(content_type, raw_response):
+    """
+    Parses a raw response of the api (downloaded or archived) into the overpy result
+
+    args:
+        content_type (str): content type of the response
+        raw_response (bytes): the uncompressed response
+
+    Returns
+        result, the same as the one given by overpy
+    """
+    api = overpy.Overpass()
+    if content_type == "application/json":
+        return api.parse_json(raw_response)
+    if content_type == "application/osm3s+xml":
+        return api.parse_xml(raw_response)
+    raise overpy.exception.OverpassUnknownContentType(content_type)
+
+
+def query_to_api(query, archive_dir=None, from_archive=None):
     """
     Sends the query to the api and manages errors
 
     args:
         query (str) : the query to send to the api, from create_query()
+        archive_dir (str) : if given, directory where the raw response is archived when the query is sent to the api
+        from_archive (str) : if given, directory where the archived response of the query is looked for,
+                             and used instead of sending the query when there is one
 
     Returns
         results (list) if the query happens without error
         False if there was an error
     """
-    api = overpy.Overpass()
     try:
-        result = api.query(query)
+        archived_response = find_archived_response(query, from_archive) if from_archive else None
+        if archived_response:
+            print(f"Using the archived response {archived_response}", file=sys.stderr)
+            content_type, raw_response = load_archived_response(archived_response)
+        else:
+            content_type, raw_response = fetch_raw_response(query)
+            if archive_dir and content_type in CONTENT_TYPES:
+                archive_raw_response(query, content_type, raw_response, archive_dir)
+        result = parse_raw_response(content_type, raw_response)
         return result
                 
-    except overpy.exception.OverpassBadRequest:
+    except overpy.exception.OverpassBadRequest as error:
         print("There was a syntax error in the query.")
+        for msg in error.msgs:
+            print(msg)
         print("Please check that your input matches the documentation's example, or that it does not contain any special characters or quotes (\", \')")
     except overpy.exception.OverpassTooManyRequests:
         print("Too many requests have been sent to the Overpass API. Please try again later.")
@@ -93,20 +230,98 @@ def query_to_api(query):
         print("An error occurred with the Overpass API.")
     except overpy.exception.OverPyException:
         print("An OverPy exception occurred.")
+    except OSError as error:
+        print(f"The query could not be sent to the Overpass API, or the archive could not be read/written: {error}")
+    except ValueError as error:
+        print(error)
     except Exception:
         print("An unexpected error occurred.")
     return False
 
-def extract_data_from_result(result):
+def node_has_tag(node, tag):
     """
-    Extract the coordinates from the raw api result
+    Checks whether a node has a tag written in the key=value (or key) format
+
+    args:
+        node: node from the raw api result
+        tag (str): the tag, as entered by the user
+
+    returns:
+        True if the node has the tag, False if not (or if the tag is written in another format)
+    """
+    key, _, value = tag.partition("=")
+    key, value = key.strip().strip("\"'"), value.strip().strip("\"'")
+    if key not in node.tags:
+        return False
+    return not value or node.tags[key] == value
+
+
+def extract_nodes_from_result(result, parameters=None):
+    """
+    Extract the nodes from the raw api result, before anything depending on the location of the search
+    (filter of the region, nearest nodes). The result can then be reused by queries on other regions.
 
     args:
         result: the raw result given by the API query
+        parameters (dict): dict of all the parameters. Needed to separate the nodes of radius queries.
 
     returns:
         coordinates (list): list of coordinates in tuples
+        near_nodes (list): (latitude, longitude, id) of the nodes of the second tag for radius queries, None otherwise
     """
     raw_data_nodes = result.get_nodes()
-    coordinates = [(float(node.lat), float(node.lon)) for node in raw_data_nodes]
-    return coordinates
+    if not parameters or parameters["type_query"] != "radius":
+        coordinates = [(float(node.lat), float(node.lon)) for node in raw_data_nodes]
+        return coordinates, None
+
+    coordinates = [(float(node.lat), float(node.lon)) for node in raw_data_nodes if node.tags]
+    # A node with both tags is only in the result once, with its tags, so it is added back to the nodes of the second tag
+    near_nodes = [(float(node.lat), float(node.lon), node.id) for node in raw_data_nodes
+                  if not node.tags or node_has_tag(node, parameters["tag_2"])]
+    return coordinates, near_nodes
+
+
+def annotate_nearest_nodes(coordinates, near_nodes, parameters):
+    """
+    Add to each result of a radius query the id of the nearest node of the second tag in the region,
+    and the distance to it (in meters)
+
+    When the polygon of the query is filtered locally, the API found the matches with the nodes of the second tag
+    of the whole bbox, so the results without any node of the second tag in the region within the radius are removed.
+
+    args:
+        coordinates (list): coordinates of the results, given by extract_nodes_from_result()
+        near_nodes (list): nodes of the second tag, given by extract_nodes_from_result()
+        parameters (dict): dict of all the parameters
+
+    returns:
+        coordinates (list): list of (latitude, longitude, nearest_id, distance)
+    """
+    near_nodes = filter_results_in_region(near_nodes, parameters)
+    nearest = nearest_nodes(coordinates, near_nodes, parameters["radius"])
+    results = [(lat, lon, nearest_id, distance) for (lat, lon), (nearest_id, distance) in zip(coordinates, nearest)]
+    polygon = parameters.get("polygon")
+    if polygon and not is_polygon_sent_to_api(polygon):
+        results = [result for result in results if result[3] is not None and result[3] <= parameters["radius"]]
+    return [(lat, lon, nearest_id, None if distance is None else round(distance, 1))
+            for lat, lon, nearest_id, distance in results]
+
+
+def extract_data_from_result(result, parameters=None):
+    """
+    Extract the coordinates from the raw api result
+
+    For radius queries, each result also contains the id of the nearest node of the second tag
+    and the distance to it (in meters): (latitude, longitude, nearest_id, distance)
+
+    args:
+        result: the raw result given by the API query
+        parameters (dict): dict of all the parameters. Needed to annotate the results of radius queries.
+
+    returns:
+        coordinates (list): list of coordinates in tuples
+    """
+    coordinates, near_nodes = extract_nodes_from_result(result, parameters)
+    if near_nodes is None:
+        return coordinates
+    return annotate_nearest_nodes(coordinates, near_nodes, parameters)
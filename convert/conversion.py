@@ -71,18 +71,25 @@ def decimal_to_dms(lat, lon):
     return (lat_str, lon_str)
 
 
-def convert_coordinates():
+def convert_coordinates(user_input=None):
     """
     Converts the coordinates. If user inputs coordinates in dms, then output in decimal. Contrary elsewise.
 
     args:
-        None
+        user_input (str): coordinates to convert (latitude, longitude). If None, the user is prompted for them.
 
     Returns a tuple of coordinates in the desired format
+    Raises a ValueError if user_input matches neither the decimal nor the dms format.
     """
-    from input.input import get_coordinates
-
-    raw_lat, raw_lon, input_format = get_coordinates()
+    from input.input import get_coordinates, parse_coordinates
+
+    if user_input is None:
+        raw_lat, raw_lon, input_format = get_coordinates()
+    else:
+        parsed_coordinates = parse_coordinates(user_input)
+        if not parsed_coordinates:
+            raise ValueError(f"Invalid coordinates format: {user_input}")
+        raw_lat, raw_lon, input_format = parsed_coordinates
     if input_format == "decimal":
         dms_lat, dms_lon = decimal_to_dms(raw_lat, raw_lon)
         return dms_lat, dms_lon
@@ -5,7 +5,9 @@ This module deals with all inputs from the user.
 """
 import sys
 import re
+import math
 from convert.conversion import dms_to_decimal
+from OSMquery.geometry import load_geojson_polygon, polygon_from_geojson
 from utils.utils import exit_prog
 
 def get_input(input_prompt, type_func=str, valid_values=None):
@@ -42,12 +44,39 @@ def get_input(input_prompt, type_func=str, valid_values=None):
             exit_prog()
 
 
-def get_coordinates(bbox = None, corner = "South West"):
+def parse_coordinates(user_input):
     """
-    Function that uses regex to manage the user's input of coordinates, when the prefered choice of location is bbox.
+    Function that uses regex to recognise a pair of coordinates written by the user.
     If in decimal format, then separate and return
     If in Dms format, then separate, turn into decimal and return
-    If none, try again.
+
+    Args:
+        user_input (str): the coordinates as written by the user (latitude, longitude).
+
+    Returns:
+        The decimal coordinates and the format they were written in, in a tuple.
+        None if the input does not match any format.
+    """
+    decimal_pattern = re.compile(r'^-?\d+\.\d+\s*,\s*-?\d+\.\d+$')
+    dms_pattern = re.compile(r'(\d+)[°\s](\d+)\'[\s]?(\d+(?:\.\d+)?)[\"]?[\s]?[NSEW],\s*(\d+)[°\s](\d+)\'[\s]?(\d+(?:\.\d+)?)[\"]?[\s]?[NSEW]')
+
+    user_input = f"""{user_input}""" # Triple quotes to deal with the special characters if the user inputs a dms-formated coordinate
+
+    if decimal_pattern.match(user_input):
+        coordinates = map(float, user_input.replace(" ", "").split(","))
+        coordinates = list(coordinates)
+        return coordinates[0], coordinates[1], "decimal"
+    if dms_pattern.match(user_input):
+        dms_lat, dms_lon = user_input.split(", ")
+        decimal_lat, decimal_lon = dms_to_decimal(dms_lat.strip(), dms_lon.strip())
+        return decimal_lat, decimal_lon, "dms"
+    return None
+
+
+def get_coordinates(bbox = None, corner = "South West"):
+    """
+    Function that manages the user's input of coordinates, when the prefered choice of location is bbox.
+    If the input matches neither the decimal nor the dms format, try again.
 
     Args:
         bbox: if prompting coordinates to get the bbox, then add something, else, nothing.
@@ -57,61 +86,81 @@ def get_coordinates(bbox = None, corner = "South West"):
         The decimal coordinates in a tuple.
     
     """
-    decimal_pattern = re.compile(r'^-?\d+\.\d+\s*,\s*-?\d+\.\d+$')
-    dms_pattern = re.compile(r'(\d+)[°\s](\d+)\'[\s]?(\d+(?:\.\d+)?)[\"]?[\s]?[NSEW],\s*(\d+)[°\s](\d+)\'[\s]?(\d+(?:\.\d+)?)[\"]?[\s]?[NSEW]')
-    input_pattern = ""
-
     while True:
         if bbox:
             user_input = get_input(f">> Enter the coordinates of the {corner} corner of the bbox: ")
         else:
             user_input = get_input(f">> Enter the coordinates : ")
 
-        user_input = f"""{user_input}""" # Triple quotes to deal with the special characters if the user inputs a dms-formated coordinate
-
         # Checks whether the user input matches either dms or decimal. if not, then ask to prompt again.
-        if decimal_pattern.match(user_input):
-            coordinates = map(float, user_input.replace(" ", "").split(","))
-            coordinates = list(coordinates)
-            input_pattern = "decimal"
-            return coordinates[0], coordinates[1], input_pattern
-        if dms_pattern.match(user_input):
-            dms_lat, dms_lon = user_input.split(", ")
-            decimal_lat, decimal_lon = dms_to_decimal(dms_lat.strip(), dms_lon.strip())
-            input_pattern = "dms"
-            return decimal_lat, decimal_lon, input_pattern
+        coordinates = parse_coordinates(user_input)
+        if coordinates:
+            return coordinates
         else:
             print("The value you entered does not match the desired format (latitude, longitude)")
             print("""Example of valid format : 48°50'41.5"N, 2°19'48.7"E [OR] 48.855208, 2.345775""")
 
+def get_bbox():
+    """
+    Function that asks the user for the two corners of a bbox
+
+    Args: None
+
+    Returns:
+        bbox (list): [latitude_SW, longitude_SW, latitude_NE, longitude_NE], coordinates in float.
+    """
+    southwest_bbox = get_coordinates(True, "Lower-Left (South-West)")
+    northeast_bbox = get_coordinates(True, "Upper-Right (North-East)")
+    return list(southwest_bbox[:2]) + list(northeast_bbox[:2]) # Removing the "input pattern" from get_coordinates that we don't need here
+
+
 def get_location():
     """
-    Function that asks the user for its prefered choice of location: specific location or bbox
+    Function that asks the user for its prefered choice of location: specific location, bbox, polygon or several bboxes
     
     Args: None
 
     Returns:
-        If user choses location, the format is : ['name_location']
-        If the user choses bbox, the format is : [longitude_SW, latitude_SW, longitude_NE, latitude_NE], coordinates in float.
+        The type of location and the location, in a tuple:
+        If user choses location, the format is : ('location', ['name_location'])
+        If the user choses bbox, the format is : ('bbox', [latitude_SW, longitude_SW, latitude_NE, longitude_NE]), coordinates in float.
+        If the user choses polygon, the format is : ('polygon', [[(latitude, longitude), ...], ...]), list of the rings of the polygon.
+        If the user choses several bboxes, the format is : ('bboxes', [bbox_1, bbox_2, ...]).
     """
-    location_name = []
     print("Please select the format for entering the location of your query:\n"
           "   1. Geographical Area (e.g. name of city, country). \n"
-          "   2. Bounding Box (square of coordinates)")
-    type_research = get_input(">> Enter your choice (1 or 2) : ", int, valid_values=[1, 2])
+          "   2. Bounding Box (square of coordinates)\n"
+          "   3. Polygon (GeoJSON file)\n"
+          "   4. Several Bounding Boxes")
+    type_research = get_input(">> Enter your choice (1, 2, 3 or 4) : ", int, valid_values=[1, 2, 3, 4])
     match type_research:
         case 1:
-            location_name.append(get_input(">> Enter the name of the city/area : ", str))
+            return 'location', [get_input(">> Enter the name of the city/area : ", str)]
         case 2:
             print("\nYou have chosen 'Bounding Box' (bbox)")
             print("If you are unsure of what a bbox is, please refer to the documentation")
             print("Input format: latitude, longitude")
-            southwest_bbox = get_coordinates(True, "Lower-Left (South-West)")
-            northeast_bbox = get_coordinates(True, "Upper-Right (North-East)")
-            location_name = list(southwest_bbox) + list(northeast_bbox) # Need to turn into a list because each element is a 'map' -> No concatenation
-            location_name.pop(2) # Removing the "input pattern" from get_coordinates that we don't need here
-            location_name.pop(4) # same
-    return location_name
+            return 'bbox', get_bbox()
+        case 3:
+            print("\nYou have chosen 'Polygon'")
+            print("The file must contain a GeoJSON Polygon or MultiPolygon (e.g. drawn on https://geojson.io)")
+            while True:
+                file_name = get_input(">> Enter the path of the GeoJSON file : ", str)
+                try:
+                    return 'polygon', load_geojson_polygon(file_name.strip().strip('"'))
+                except ValueError as error:
+                    print(error)
+        case 4:
+            print("\nYou have chosen 'Several Bounding Boxes'")
+            print("Input format: latitude, longitude")
+            bbox_count = 0
+            while bbox_count < 1:
+                bbox_count = get_input(">> Enter the number of bboxes : ", int)
+            bboxes = []
+            for bbox_number in range(1, bbox_count + 1):
+                print(f"\nBbox {bbox_number}/{bbox_count}")
+                bboxes.append(get_bbox())
+            return 'bboxes', bboxes
 
 
 def get_query_details(query_type):
@@ -130,13 +179,12 @@ def get_query_details(query_type):
         'tag_1' : None,
         'tag_2' : None,
         'radius' : None,
+        'polygon' : None,
+        'bboxes' : None,
     }
 
-    location_input = get_location()
-    if len(location_input) == 1:
-        details["location"] = location_input
-    elif len(location_input) == 4:
-        details["bbox"] = location_input
+    location_type, location_input = get_location()
+    details[location_type] = location_input
     
     match query_type:
         case "locate":
@@ -146,3 +194,68 @@ def get_query_details(query_type):
             details['tag_2'] = get_input(">> Enter the second tag : ", str)
             details['radius'] = get_input(">> Enter the radius (in meters) : ", int)
     return details
+
+
+def build_parameters(type_query, details):
+    """
+    Builds the dictionary with information about the query from details given without prompt
+    (JSON body of a server request, preset of the config file)
+
+    args:
+        type_query (str): either "locate" or "radius"
+        details (dict): details of the query, e.g. {"location": "Paris", "tag_1": "shop=bakery"}
+            The location can also be given as "bbox", "polygon" (GeoJSON geometry) or "bboxes" (list of bbox).
+
+    Returns:
+        parameters (dict), with the query details of the one built by osmosint.main
+        Raises a ValueError if a parameter is missing or invalid.
+    """
+    parameters = {
+        "type_query" : type_query,
+        "location" : None,
+        "bbox" : None,
+        "tag_1" : details.get("tag_1"),
+        "tag_2" : details.get("tag_2"),
+        "radius" : details.get("radius"),
+        "polygon" : None,
+        "bboxes" : None,
+    }
+
+    def check_coordinate(coordinate):
+        # Numbers, or numbers written in strings (values of the variables of a preset)
+        if isinstance(coordinate, (int, float, str)) and not isinstance(coordinate, bool):
+            try:
+                if math.isfinite(float(coordinate)):
+                    return float(coordinate)
+            except ValueError:
+                pass
+        raise ValueError(f"Invalid coordinate in a bbox: {coordinate!r}. Coordinates are numbers in decimal format.")
+
+    def check_bbox(bbox):
+        if not isinstance(bbox, list) or len(bbox) != 4:
+            raise ValueError("A bbox must be a list of 4 coordinates: [lat_SW, lon_SW, lat_NE, lon_NE].")
+        return [check_coordinate(coordinate) for coordinate in bbox]
+
+    if details.get("location"):
+        if not isinstance(details["location"], str):
+            raise ValueError("'location' must be the name of an area (e.g. \"Paris\").")
+        parameters["location"] = [details["location"]]
+    elif details.get("bbox"):
+        parameters["bbox"] = check_bbox(details["bbox"])
+    elif details.get("polygon"):
+        parameters["polygon"] = polygon_from_geojson(details["polygon"])
+    elif details.get("bboxes"):
+        if not isinstance(details["bboxes"], list):
+            raise ValueError("'bboxes' must be a list of bboxes.")
+        parameters["bboxes"] = [check_bbox(bbox) for bbox in details["bboxes"]]
+    else:
+        raise ValueError("One of 'location', 'bbox', 'polygon' (GeoJSON) or 'bboxes' must be given.")
+
+    if not isinstance(parameters["tag_1"], str) or not parameters["tag_1"]:
+        raise ValueError("'tag_1' must be given (format: 'key=value').")
+    if type_query == "radius":
+        if not isinstance(parameters["tag_2"], str) or not parameters["tag_2"]:
+            raise ValueError("'tag_2' must be given (format: 'key=value').")
+        if not isinstance(parameters["radius"], int) or isinstance(parameters["radius"], bool) or parameters["radius"] <= 0:
+            raise ValueError("'radius' must be a positive number of meters.")
+    return parameters
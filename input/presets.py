@@ -0,0 +1,199 @@
+"""
+Osmosint presets module
+
+This module deals with the presets: queries saved in a TOML config file, that can be run without any prompt.
+
+Example of config file:
+
+    [templates.near]
+    type_query = "radius"
+    tag_1 = "{tag}"
+    tag_2 = "{near}"
+    radius = "{radius}"
+    variables = { radius = 10 }
+
+    [presets.benches_near_bakeries]
+    template = "near"
+    location = "{area}"
+    variables = { area = "Paris", tag = "amenity=bench", near = "shop=bakery" }
+
+    [presets.pharmacies_london]
+    type_query = "locate"
+    location = "London"
+    tag_1 = "amenity=pharmacy"
+"""
+import os
+import re
+import json
+from functools import lru_cache
+from input.input import build_parameters
+from OSMquery.query import create_query
+
+DEFAULT_CONFIG_FILE = "presets.toml"
+VARIABLE_PATTERN = re.compile(r"\{(\w+)\}")
+
+
+def load_config(config_file):
+    """
+    Reads the TOML config file
+
+    args:
+        config_file (str): path of the config file
+
+    Returns:
+        config (dict)
+        Raises a ValueError if the file cannot be read.
+    """
+    # Imported here, so that the other commands do not need a TOML parser
+    try:
+        import tomllib # Python 3.11+
+    except ModuleNotFoundError:
+        try:
+            import tomli as tomllib
+        except ModuleNotFoundError:
+            raise ValueError("Reading the presets needs Python 3.11+ or the tomli package: pip install tomli")
+
+    try:
+        with open(config_file, "rb") as file:
+            return tomllib.load(file)
+    except OSError as error:
+        raise ValueError(f"The config file {config_file} could not be opened: {error.strerror}")
+    except tomllib.TOMLDecodeError as error:
+        raise ValueError(f"The config file {config_file} is not a valid TOML file: {error}")
+
+
+def list_presets(config_file=DEFAULT_CONFIG_FILE):
+    """
+    Lists the presets of the config file
+
+    args:
+        config_file (str): path of the config file
+
+    Returns:
+        list of (name, description) tuples
+    """
+    config = load_config(config_file)
+    return [(name, preset.get("description", "")) for name, preset in config.get("presets", {}).items()]
+
+
+def fill_variables(value, variables, preset_name):
+    """
+    Replaces the {variables} of a value of the preset by their value
+
+    args:
+        value: value of the preset (str, list or number)
+        variables (dict): {name: value} of the variables
+        preset_name (str): name of the preset, for error messages
+
+    Returns:
+        The value with the variables replaced.
+        A value made of a single variable (e.g. "{radius}") takes the value of the variable, with its type.
+    """
+    def variable_value(name):
+        if name not in variables:
+            raise ValueError(f"The variable '{name}' of the preset {preset_name} has no value. Give it one with --set {name}=value.")
+        return variables[name]
+
+    if isinstance(value, list):
+        return [fill_variables(element, variables, preset_name) for element in value]
+    if not isinstance(value, str):
+        return value
+    single_variable = VARIABLE_PATTERN.fullmatch(value)
+    if single_variable:
+        return variable_value(single_variable.group(1))
+    return VARIABLE_PATTERN.sub(lambda match: str(variable_value(match.group(1))), value)
+
+
+@lru_cache(maxsize=64)
+def compile_preset_query(config_file, modified_time, preset_name, variables_json):
+    """
+    Builds the parameters and the query of a preset. The result is cached until the config file is modified.
+
+    args:
+        config_file (str): path of the config file
+        modified_time (float): time of the last modification of the config file, to recompile it once modified
+        preset_name (str): name of the preset
+        variables_json (str): the variables given on top of the config file, in JSON (to be used as a cache key)
+
+    Returns:
+        parameters (dict) and query (str) ready to be sent to the API
+    """
+    config = load_config(config_file)
+    preset = config.get("presets", {}).get(preset_name)
+    if preset is None:
+        raise ValueError(f"There is no preset named {preset_name} in {config_file}.")
+
+    details = {}
+    variables = {}
+    if "template" in preset:
+        template = config.get("templates", {}).get(preset["template"])
+        if template is None:
+            raise ValueError(f"The preset {preset_name} uses the template {preset['template']}, which does not exist in {config_file}.")
+        details.update(template)
+        variables.update(template.get("variables", {}))
+    details.update(preset)
+    variables.update(preset.get("variables", {}))
+    variables.update(json.loads(variables_json))
+
+    details = {key: fill_variables(value, variables, preset_name) for key, value in details.items()
+               if key not in ("template", "variables", "description")}
+
+    if isinstance(details.get("radius"), str) and details["radius"].isdigit(): # Variables given with --set are strings
+        details["radius"] = int(details["radius"])
+    if isinstance(details.get("polygon"), str): # Path of a GeoJSON file, relative to the config file
+        polygon_file = os.path.join(os.path.dirname(config_file), details["polygon"])
+        try:
+            with open(polygon_file, encoding="utf-8") as file:
+                details["polygon"] = json.load(file)
+        except (OSError, json.JSONDecodeError):
+            raise ValueError(f"The GeoJSON file {polygon_file} of the preset {preset_name} could not be read.")
+
+    type_query = details.get("type_query")
+    if type_query not in ("locate", "radius"):
+        raise ValueError(f"The preset {preset_name} must have a type_query: 'locate' or 'radius'.")
+    try:
+        parameters = build_parameters(type_query, details)
+    except ValueError as error:
+        raise ValueError(f"The preset {preset_name} is invalid: {error}")
+    return parameters, create_query(parameters)
+
+
+def compile_preset(preset_name, variables=None, config_file=DEFAULT_CONFIG_FILE):
+    """
+    Gets the parameters and the query of a preset, compiled only once for the same preset and variables
+
+    args:
+        preset_name (str): name of the preset
+        variables (dict): {name: value} of variables replacing the ones of the config file (e.g. from --set)
+        config_file (str): path of the config file
+
+    Returns:
+        parameters (dict) and query (str) ready to be sent to the API
+        Raises a ValueError if the preset cannot be compiled.
+    """
+    try:
+        modified_time = os.path.getmtime(config_file)
+    except OSError:
+        raise ValueError(f"The config file {config_file} could not be found.")
+    parameters, query = compile_preset_query(config_file, modified_time, preset_name, json.dumps(variables or {}, sort_keys=True))
+    return dict(parameters), query # Copy, so that the cached parameters are never modified
+
+
+def parse_variables(assignments):
+    """
+    Turns the --set arguments into a dict of variables
+
+    args:
+        assignments (list): list of "name=value" strings
+
+    Returns:
+        variables (dict)
+        Raises a ValueError if an assignment is not in the name=value format.
+    """
+    variables = {}
+    for assignment in assignments:
+        name, separator, value = assignment.partition("=")
+        if not separator or not name.strip():
+            raise ValueError(f"Invalid variable: {assignment}. Format: name=value (e.g. --set area=Paris)")
+        variables[name.strip()] = value.strip()
+    return variables
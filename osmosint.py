@@ -7,9 +7,11 @@ This module is the main module to access anything anywhere.
 """
 
 from input.input import get_query_details
+from input.presets import compile_preset, list_presets, parse_variables
 from convert.conversion import convert_coordinates
 from OSMquery.output import check_if_results, output_results, welcome
-from OSMquery.query import create_query, query_to_api, extract_data_from_result
+from OSMquery.query import create_query, query_to_api, extract_data_from_result, filter_results_in_region
+from server.server import serve
 from utils.utils import parse_args, exit_prog
 import sys
 
@@ -19,34 +21,64 @@ def main():
     if welcome(args) == False :  # Welcomes and makes sure that a command has been entered.
         sys.exit()
 
-    if args.command == 'locate' or args.command == 'radius':
-        
-        query_details = get_query_details(args.command)
+    if args.command == 'locate' or args.command == 'radius' or args.command == 'run':
+        results_output = sys.stdout
+        if args.stream: # Only the results are printed on stdout, the questions and messages go to stderr
+            sys.stdout = sys.stderr
+
+        if args.command == 'run': # The query details come from the config file instead of the prompts
+            try:
+                if not args.preset:
+                    print(f"Presets of {args.config}:")
+                    for name, description in list_presets(args.config):
+                        print(f"    {name}" + (f" : {description}" if description else ""))
+                    sys.exit()
+                query_details, query = compile_preset(args.preset, parse_variables(args.variables), args.config)
+            except ValueError as error:
+                print(error)
+                exit_prog(1)
+        else:
+            query_details = get_query_details(args.command)
+            query = None
         
         parameters = { # Builds the dictionary with information about the query
-            "type_query" : args.command,
+            "type_query" : query_details.get('type_query', args.command),
             "location" : query_details.get('location'),
             "bbox" : query_details.get('bbox'),
             "tag_1" : query_details.get('tag_1'),
             "tag_2" : query_details.get('tag_2'),
             "radius" : query_details.get('radius'),
+            "polygon" : query_details.get('polygon'),
+            "bboxes" : query_details.get('bboxes'),
             "file_type" : args.write_file,
             "google_urls" : args.google_urls,
+            "link_providers" : args.links,
             "decimal_coord" : args.decimal_coords,
             "dms_coord" : args.dms_coords,
+            "limit" : args.limit,
+            "offset" : args.offset,
+            "page_size" : args.page_size,
+            "stream" : args.stream,
+            "threshold" : args.threshold,
+            "sort_distance" : getattr(args, 'sort_distance', False),
         }
-        query = create_query(parameters)
-        query_result = query_to_api(query)
+        if not query:
+            query = create_query(parameters)
+        query_result = query_to_api(query, args.archive, args.from_archive)
         
         if query_result == False:
-            exit_prog()
+            exit_prog(1)
         else:
-            extracted_results = extract_data_from_result(query_result)   
+            extracted_results = extract_data_from_result(query_result, parameters)
+            extracted_results = filter_results_in_region(extracted_results, parameters)
+            if parameters["sort_distance"] and parameters["type_query"] == "radius": # Only radius results have a distance
+                extracted_results.sort(key=lambda result: float("inf") if result[3] is None else result[3])
 
         is_result = check_if_results(extracted_results, parameters)
         if is_result == False:
             exit_prog()
 
+        sys.stdout = results_output
         output_results(extracted_results, parameters)
 
     elif args.command == 'convert':
@@ -55,6 +87,9 @@ def main():
             if lat:
                 print(f"{lat}, {lon}")
 
+    elif args.command == 'serve':
+        serve(args.host, args.port, args.workers, args.cache_ttl, args.config, args.archive)
+
 
 if __name__ == "__main__":
     main()
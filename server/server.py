@@ -0,0 +1,303 @@
+"""
+Osmosint server module
+
+This module deals with the local HTTP service of Osmosint (serve command).
+A single server can be shared by a whole team: identical queries are only sent once to the Overpass API,
+their results are kept in a shared cache, and the number of simultaneous Overpass requests is bounded.
+"""
+import json
+import time
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from convert.conversion import convert_coordinates
+from input.input import build_parameters
+from input.presets import DEFAULT_CONFIG_FILE, compile_preset
+from OSMquery.output import LINK_TEMPLATES, format_results
+from OSMquery.query import create_query, query_to_api, extract_nodes_from_result, annotate_nearest_nodes, filter_results_in_region
+from utils.utils import exit_prog
+
+MAX_BODY_SIZE = 1_000_000 # Bytes, requests with a bigger body are refused
+CONNECTION_TIMEOUT = 30 # Seconds to receive a request or to send its response, before the connection is closed
+
+HTTP_STATUS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    408: "Request Timeout",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    502: "Bad Gateway",
+}
+
+
+def format_response_results(results, formats):
+    """
+    Turns the decimal coordinates into every output format asked for in the request
+
+    args:
+        results (list): list of tuples of decimal coordinates
+        formats (list): output formats, among "decimal", "dms", "urls" (Google Maps) and "<provider>_urls" (e.g. "osm_urls")
+
+    Returns:
+        dict of {format: list of results}
+    """
+    allowed_formats = ["decimal", "dms", "urls"] + [f"{provider}_urls" for provider in LINK_TEMPLATES]
+    formatted_results = {}
+    for format_type in formats:
+        if format_type not in allowed_formats:
+            raise ValueError(f"Unknown output format: {format_type}. Allowed formats: {', '.join(allowed_formats)}.")
+        output_format = "google_urls" if format_type == "urls" else format_type
+        if output_format.endswith("_urls"):
+            formatted_results[format_type] = [url for url, in format_results(results, output_format)]
+        else:
+            formatted_results[format_type] = [list(result) for result in format_results(results, output_format)]
+    return formatted_results
+
+
+async def read_request(reader):
+    """
+    Reads the request line, the headers and the body of an HTTP request
+
+    args:
+        reader (asyncio.StreamReader): stream of the connection of the client
+
+    Returns:
+        method (str), target (str) and body (bytes) of the request. The body is None if it is too big.
+        Raises a ValueError if the request is malformed.
+    """
+    request_line = await reader.readline()
+    method, target, _ = request_line.decode("latin-1").split(" ", 2)
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    content_length = int(headers.get("content-length", 0))
+    if content_length > MAX_BODY_SIZE:
+        return method, target, None
+    raw_body = await reader.readexactly(content_length) if content_length else b""
+    return method, target, raw_body
+
+
+def fetch_nodes(query, parameters, archive_dir=None):
+    """
+    Sends the query to the API and extracts its nodes, in a worker thread of the server
+
+    args:
+        query (str): Overpass QL query
+        parameters (dict): parameters of the query, the nodes only depend on those already in the query
+        archive_dir (str): if given, directory where the raw response of the API is archived
+
+    Returns:
+        (coordinates, near_nodes) given by extract_nodes_from_result(), False if the query failed
+    """
+    query_result = query_to_api(query, archive_dir)
+    if query_result == False:
+        return False
+    return extract_nodes_from_result(query_result, parameters)
+
+
+def process_results(nodes, parameters, formats, sort_distance=False):
+    """
+    Computes the response of a request from the nodes of its query: nearest nodes, filter of the region, sort and formats.
+    Runs in a worker thread, since it can take a while for big results.
+
+    args:
+        nodes (tuple): (coordinates, near_nodes) given by fetch_nodes()
+        parameters (dict): parameters of the request
+        formats (list): output formats of the response
+        sort_distance (bool): sort the results of radius queries by distance to the nearest node
+
+    Returns:
+        results (list): the results in decimal coordinates
+        formatted_results (dict): {format: list of results}
+    """
+    coordinates, near_nodes = nodes
+    if near_nodes is not None:
+        coordinates = annotate_nearest_nodes(coordinates, near_nodes, parameters)
+    results = filter_results_in_region(coordinates, parameters)
+    if sort_distance and parameters["type_query"] == "radius":
+        results.sort(key=lambda result: float("inf") if result[3] is None else result[3])
+    return results, format_response_results(results, formats)
+
+
+def serve(host="127.0.0.1", port=8000, workers=2, cache_ttl=3600, config_file=DEFAULT_CONFIG_FILE, archive_dir=None, cache_size=256):
+    """
+    Launches the Osmosint HTTP server and handles requests until the program is stopped.
+
+    Endpoints (JSON body, POST):
+        /locate  {"location", "bbox", "polygon" or "bboxes", "tag_1", "formats"}
+        /radius  {"location", "bbox", "polygon" or "bboxes", "tag_1", "tag_2", "radius", "formats", "sort_distance"}
+        /run     {"preset", "variables", "formats", "sort_distance"}
+        /convert {"coordinates": "48.855208, 2.345775"}
+    GET /status returns the state of the cache.
+
+    args:
+        host (str): address the server listens on
+        port (int): port the server listens on
+        workers (int): maximal number of queries sent to the Overpass API at the same time
+        cache_ttl (int): number of seconds a result stays in the cache
+        config_file (str): path of the config file with the presets for /run
+        archive_dir (str): if given, directory where the raw responses of the API are archived
+        cache_size (int): maximal number of query results kept in the cache
+
+    Returns nothing.
+    """
+    executor = ThreadPoolExecutor(max_workers=workers)
+    # Separate pool, so that the results of the cache are not waiting for the queries sent to the API
+    processing_executor = ThreadPoolExecutor()
+    cache = OrderedDict() # {query: (time of the query, extracted nodes)}, oldest used first
+    in_flight = {} # {query: task}, queries currently sent to the API
+
+    async def fetch_and_cache(query, parameters):
+        try:
+            loop = asyncio.get_running_loop()
+            nodes = await loop.run_in_executor(executor, fetch_nodes, query, parameters, archive_dir)
+            if nodes != False: # Errors are not cached, so the next request tries again
+                cache[query] = (time.monotonic(), nodes)
+                cache.move_to_end(query)
+                while len(cache) > cache_size:
+                    cache.popitem(last=False)
+            return nodes
+        finally:
+            del in_flight[query]
+
+    async def get_results(query, parameters):
+        # Returns the extracted nodes of the query, and whether they came from the cache.
+        # The nodes are cached before the filter of the region and the nearest nodes, since the same query can be
+        # shared by requests with different parameters (e.g. polygons with the same bbox).
+        # Everything else the extraction depends on (type of query, tags, radius) is part of the query.
+        cached = cache.get(query)
+        if cached and time.monotonic() - cached[0] < cache_ttl:
+            cache.move_to_end(query)
+            return cached[1], True
+
+        # Identical queries arriving while the first one is running all wait for the same API call
+        if query not in in_flight:
+            in_flight[query] = asyncio.create_task(fetch_and_cache(query, parameters))
+        nodes = await asyncio.shield(in_flight[query])
+        return nodes, False
+
+    async def handle_query(endpoint, body):
+        loop = asyncio.get_running_loop()
+        try:
+            if endpoint == "run": # Preset of the config file, compiled once and then reused
+                variables = body.get("variables", {})
+                if not isinstance(body.get("preset"), str) or not isinstance(variables, dict):
+                    raise ValueError("'preset' (name of the preset) must be given, and 'variables' must be an object.")
+                # Reads the config file (and the GeoJSON file of the preset) when it is not compiled yet
+                parameters, query = await loop.run_in_executor(processing_executor, compile_preset, body["preset"], variables, config_file)
+            else:
+                parameters = build_parameters(endpoint, body)
+                query = create_query(parameters)
+            type_query = parameters["type_query"]
+            formats = body.get("formats", ["decimal"])
+            if not isinstance(formats, list):
+                raise ValueError("'formats' must be a list.")
+            format_response_results([], formats) # Unknown formats are refused before querying the API
+        except ValueError as error:
+            return 400, {"error": str(error)}
+
+        nodes, cached = await get_results(query, parameters)
+        if nodes == False:
+            return 502, {"error": "The query to the Overpass API failed. Check the server output for more details."}
+        results, formatted_results = await loop.run_in_executor(
+            processing_executor, process_results, nodes, parameters, formats, bool(body.get("sort_distance")))
+        response = {
+            "type_query": type_query,
+            "count": len(results),
+            "cached": cached,
+            "results": formatted_results,
+        }
+        if type_query == "radius": # Nearest node of the second tag, in the same order as the results
+            response["nearest"] = [{"id": result[2], "distance": result[3]} for result in results]
+        return 200, response
+
+    def handle_convert(body):
+        try:
+            lat, lon = convert_coordinates(str(body["coordinates"]))
+        except KeyError:
+            return 400, {"error": "'coordinates' must be given (format: latitude, longitude)."}
+        except ValueError as error:
+            return 400, {"error": str(error)}
+        return 200, {"coordinates": [lat, lon]}
+
+    async def dispatch(method, path, raw_body):
+        routes = {"/locate", "/radius", "/run", "/convert", "/status"}
+        if path not in routes:
+            return 404, {"error": f"Unknown endpoint: {path}"}
+
+        if path == "/status":
+            if method != "GET":
+                return 405, {"error": "Use GET for /status."}
+            return 200, {"cached_queries": len(cache), "queries_in_flight": len(in_flight), "workers": workers}
+
+        if method != "POST":
+            return 405, {"error": f"Use POST with a JSON body for {path}."}
+        try:
+            body = json.loads(raw_body or b"{}")
+        except ValueError:
+            return 400, {"error": "The body of the request is not valid JSON."}
+        if not isinstance(body, dict):
+            return 400, {"error": "The body of the request must be a JSON object."}
+
+        if path == "/convert":
+            return handle_convert(body)
+        return await handle_query(path.lstrip("/"), body)
+
+    async def handle_connection(reader, writer):
+        try:
+            status = None
+            try: # Clients that connect without sending their request do not keep the connection open
+                method, target, raw_body = await asyncio.wait_for(read_request(reader), CONNECTION_TIMEOUT)
+                if raw_body is None:
+                    status, payload = 413, {"error": "The body of the request is too big."}
+            except (ValueError, asyncio.IncompleteReadError):
+                status, payload = 400, {"error": "Malformed HTTP request."}
+            except asyncio.TimeoutError:
+                status, payload = 408, {"error": f"The request was not received within {CONNECTION_TIMEOUT}s."}
+
+            if status is None:
+                try:
+                    status, payload = await dispatch(method.upper(), urlsplit(target).path, raw_body)
+                except Exception as error: # The server keeps running, whatever happens with a request
+                    print(f"An unexpected error occurred while handling a request: {error!r}")
+                    status, payload = 500, {"error": "An unexpected error occurred. Check the server output for more details."}
+
+            response_body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            writer.write(
+                f"HTTP/1.1 {status} {HTTP_STATUS[status]}\r\n"
+                "Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(response_body)}\r\n"
+                "Connection: close\r\n\r\n".encode("latin-1") + response_body
+            )
+            await asyncio.wait_for(writer.drain(), CONNECTION_TIMEOUT)
+        except (ConnectionError, asyncio.TimeoutError): # The client left, or does not read the response
+            pass
+        finally:
+            writer.close()
+
+    async def run_server():
+        server = await asyncio.start_server(handle_connection, host, port)
+        print(f"Osmosint server listening on http://{host}:{port} ({workers} worker(s), cache of {cache_ttl}s)")
+        print("Press Ctrl+C to stop the server.\n")
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run_server())
+    except KeyboardInterrupt:
+        exit_prog()
+    except OSError as error:
+        print(f"The server could not be started on {host}:{port}: {error.strerror}")
+        exit_prog()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        processing_executor.shutdown(wait=False, cancel_futures=True)
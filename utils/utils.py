@@ -6,16 +6,37 @@ This module deals with the parser for Osmosint.
 import argparse
 import sys
 
-def exit_prog():
+def exit_prog(status=0):
     """
     Function to exit the program and send a message
 
-    args: None
+    args:
+        status (int): exit status of the program, not 0 when it stops because of an error
 
     Return: None
     """
     print("Exiting the program...")
-    sys.exit()
+    sys.exit(status)
+
+
+def non_negative_int(value):
+    """
+    Argument type for numbers that cannot be negative (e.g. --limit, --offset)
+    """
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"must be 0 or more, not {number}")
+    return number
+
+
+def positive_int(value):
+    """
+    Argument type for numbers that must be at least 1 (e.g. --page_size)
+    """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be 1 or more, not {number}")
+    return number
 
 
 def parse_args():
@@ -27,9 +48,12 @@ def parse_args():
 
     Returns the args
     """
+    from OSMquery.output import LINK_TEMPLATES
+    from input.presets import DEFAULT_CONFIG_FILE
+
     parser = argparse.ArgumentParser(
         description="This program processes OpenStreetMap (OSM) data to get the coordinates of specific elements anywhere on earth.",
-        epilog="Use the subcommands 'locate', 'radius, or 'convert' for specific actions. For more information on each subcommand, use -h or --help after the subcommand."
+        epilog="Use the subcommands 'locate', 'radius', 'run', 'convert' or 'serve' for specific actions. For more information on each subcommand, use -h or --help after the subcommand."
     )
 
     def add_location_arguments(subparser):
@@ -45,11 +69,41 @@ def parse_args():
                                "--google_urls",
                                action='store_true',
                                help="Generate Google Maps URLs for the coordinates")
+        subparser.add_argument("-l",
+                               "--links",
+                               nargs='+',
+                               choices=list(LINK_TEMPLATES),
+                               help="Generate map URLs for the coordinates, for one or several providers (google, osm, bing, geo)")
         subparser.add_argument("-w",
                                "--write_file",
                                type=str,
                                choices=['txt', 'csv'],
                                help="Write the output to a file (txt or csv)")
+        subparser.add_argument("--limit",
+                               type=non_negative_int,
+                               help="Output at most this number of results")
+        subparser.add_argument("--offset",
+                               type=non_negative_int,
+                               default=0,
+                               help="Skip this number of results before the output (default: 0)")
+        subparser.add_argument("--page_size",
+                               type=positive_int,
+                               help="Print the results page by page, with this number of results per page")
+        subparser.add_argument("--stream",
+                               action='store_true',
+                               help="Print only the results, one line per result, so that they can be piped to another program. The questions and messages are printed on stderr, and the exit status is 1 if there is no result or an error")
+        subparser.add_argument("--threshold",
+                               type=non_negative_int,
+                               default=100,
+                               help="Number of results above which the program asks before printing them, 0 to never ask (default: 100)")
+        subparser.add_argument("--archive",
+                               type=str,
+                               metavar="DIRECTORY",
+                               help="Save the compressed raw response of the Overpass API in this directory")
+        subparser.add_argument("--from_archive",
+                               type=str,
+                               metavar="DIRECTORY",
+                               help="Use the response archived in this directory (see --archive) instead of sending the query again, if there is one. Queries sent anyway are only archived with --archive")
 
     add_location_arguments(parser)
     
@@ -62,10 +116,63 @@ def parse_args():
     parser_radius = subparser.add_parser('radius',
                                          help="Locate OSM tag within a given radius of another tag")
     add_location_arguments(parser_radius)
+    parser_radius.add_argument("--sort_distance",
+                               action='store_true',
+                               help="Sort the results by distance to the nearest element of the second tag")
+
+    parser_run = subparser.add_parser('run',
+                                      help="Run a query saved as a preset in the config file, without any prompt")
+    parser_run.add_argument("preset",
+                            nargs='?',
+                            help="Name of the preset to run. Without it, the presets of the config file are listed")
+    parser_run.add_argument("-c",
+                            "--config",
+                            type=str,
+                            default=DEFAULT_CONFIG_FILE,
+                            help=f"Path of the TOML config file with the presets (default: {DEFAULT_CONFIG_FILE})")
+    parser_run.add_argument("-s",
+                            "--set",
+                            dest="variables",
+                            action='append',
+                            default=[],
+                            metavar="VARIABLE=VALUE",
+                            help="Give a value to a variable of the preset (e.g. --set area=Paris). Can be repeated")
+    add_location_arguments(parser_run)
+    parser_run.add_argument("--sort_distance",
+                            action='store_true',
+                            help="Sort the results of radius presets by distance to the nearest element of the second tag")
     
     
     parser_convert = subparser.add_parser('convert',
                                           help="Change the format from coordinates (from DMS to decimal, or the contrary)")
+
+    parser_serve = subparser.add_parser('serve',
+                                        help="Launch a local HTTP server answering locate, radius and convert requests (JSON)")
+    parser_serve.add_argument("--host",
+                              type=str,
+                              default="127.0.0.1",
+                              help="Address the server listens on (default: 127.0.0.1)")
+    parser_serve.add_argument("--port",
+                              type=int,
+                              default=8000,
+                              help="Port the server listens on (default: 8000)")
+    parser_serve.add_argument("--workers",
+                              type=positive_int,
+                              default=2,
+                              help="Maximal number of queries sent to the Overpass API at the same time (default: 2)")
+    parser_serve.add_argument("--cache_ttl",
+                              type=int,
+                              default=3600,
+                              help="Number of seconds a query result stays in the cache (default: 3600)")
+    parser_serve.add_argument("-c",
+                              "--config",
+                              type=str,
+                              default=DEFAULT_CONFIG_FILE,
+                              help=f"Path of the TOML config file with the presets for /run (default: {DEFAULT_CONFIG_FILE})")
+    parser_serve.add_argument("--archive",
+                              type=str,
+                              metavar="DIRECTORY",
+                              help="Save the compressed raw responses of the Overpass API in this directory")
     
 
 